@@ -0,0 +1,75 @@
+# Time limits, cancellation and progress reporting for long runs.
+
+# Generating and drawing a big board can take minutes, and an unlucky size and seed can keep the fill loops going
+# much longer than usual. The long loops call Budget.check every so often (every row, or every few thousand steps),
+# which reports progress at most every interval seconds, and raises OutOfTime once the deadline has passed or
+# cancel() has been called. The exception says which phase stopped and how far it got; what was done until then is
+# left in place (a partly filled board, or an output file holding the outlines written so far).
+
+
+import time
+
+
+class OutOfTime(Exception):
+    def __init__(self, phase, reason, elapsed, counts):
+        self.phase = phase
+        self.reason = reason
+        self.elapsed = elapsed
+        self.counts = counts
+        # the number of outlines in the output file, if one was started
+        self.written = None
+        super().__init__(f"{reason} during {phase} after {elapsed:.1f}s ({_fmt(counts)})")
+
+
+def _fmt(counts):
+    parts = []
+    for k, v in counts.items():
+        if isinstance(v, float):
+            parts.append(f"{k} {v:.1%}")
+        else:
+            parts.append(f"{k} {v}")
+    return ", ".join(parts)
+
+
+class Budget(object):
+    # seconds is the time allowed from now (None for no limit);
+    # progress(phase, counts) is called at most every interval seconds, where
+    # counts is a dict such as {"filled": 0.73} or {"outlines": 120, "bytes": 45000}
+    def __init__(self, seconds=None, progress=None, interval=1.0):
+        self.started = time.monotonic()
+        self.deadline = None if seconds is None else self.started + seconds
+        self.progress = progress
+        self.interval = interval
+        self.next_report = self.started
+        self.cancelled = False
+
+    # asks the running phase to stop at its next check; safe to call from
+    # another thread or a signal handler
+    def cancel(self):
+        self.cancelled = True
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    # counts is a dict, or a function returning one, so that counts that are
+    # costly to work out are only made when they're needed
+    def check(self, phase, counts):
+        now = time.monotonic()
+        stop = None
+        if self.cancelled:
+            stop = "cancelled"
+        elif self.deadline is not None and now >= self.deadline:
+            stop = "timed out"
+        if stop is None and (self.progress is None or now < self.next_report):
+            return
+        if callable(counts):
+            counts = counts()
+        if stop is not None:
+            raise OutOfTime(phase, stop, now - self.started, counts)
+        self.next_report = now + self.interval
+        self.progress(phase, counts)
+
+
+# prints progress the way the rest of the program prints
+def print_progress(phase, counts):
+    print(f"progress: {phase}: {_fmt(counts)}")
@@ -0,0 +1,156 @@
+# G-code and DXF writers.
+
+# These write the closed outlines straight from their segments -- lines, and quarter arcs -- instead of going
+# through an SVG file, so an arc can be written as a real arc (G2/G3 in G-code, a bulge in DXF) rather than the
+# Bezier curve the SVG uses. An arc segment's ctr is the corner where the tangents at its ends meet, so the
+# center of its circle is the opposite corner, fr + to - ctr. With arcs="lines", each arc is instead flattened into short lines that follow the
+# same curve as the SVG, including the shape given by the endcap's tween factor.
+
+# A format object turns one outline into text and knows the header and footer of its file; ExportDoc streams them
+# to the file like SVGDoc does. Format objects hold no open files, so they can be sent to rendering workers.
+# Numbers are written with svg._sc, so they share its precision and cache.
+
+# Both formats use y pointing up, so points are flipped within the page.
+
+import math
+
+from svg import _sc
+
+
+class ExportFormat(object):
+    def __init__(self, pageheight, tween_factor, arcs="native", steps=8):
+        self.pageheight = pageheight
+        self.tween_factor = tween_factor
+        self.arcs = arcs
+        self.steps = steps
+
+    def xy(self, pt):
+        return pt.x, self.pageheight - pt.y
+
+    # returns the center of the circle an arc segment follows
+    def center(self, fr, to, ctr):
+        return fr.x + to.x - ctr.x, fr.y + to.y - ctr.y
+
+    # returns the points along an arc, after its start, as lines would draw
+    # it, following the Bezier curve that the SVG draws
+    def flatten(self, fr, to, ctr):
+        ctrl1 = fr.tween(ctr, self.tween_factor)
+        ctrl2 = to.tween(ctr, self.tween_factor)
+        pts = []
+        for i in range(1, self.steps):
+            t = i / self.steps
+            a = fr.tween(ctrl1, t)
+            b = ctrl1.tween(ctrl2, t)
+            c = ctrl2.tween(to, t)
+            ab = a.tween(b, t)
+            bc = b.tween(c, t)
+            pts.append(ab.tween(bc, t))
+        pts.append(to)
+        return pts
+
+    def header(self):
+        return ""
+
+    def footer(self):
+        return ""
+
+
+class GCodeFormat(ExportFormat):
+    def __init__(self, pageheight, tween_factor, arcs="native", steps=8, feed=1000):
+        super().__init__(pageheight, tween_factor, arcs, steps)
+        self.feed = feed
+
+    def pos(self, pt):
+        x, y = self.xy(pt)
+        return f"X{_sc(x)} Y{_sc(y)}"
+
+    def header(self):
+        return "; Lattice Generator\nG21\nG90\n"
+
+    def footer(self):
+        return "M5\nG0 X0 Y0\nM2\n"
+
+    # moves to the start with the tool off, then cuts the outline
+    def format(self, stroke, scale, offset):
+        last = stroke.segments[0].fr.scaled(scale, offset)
+        out = [f"G0 {self.pos(last)}", "M3"]
+        feed = f" F{self.feed}"
+        for s in stroke.segments:
+            to = s.to.scaled(scale, offset)
+            if s.op == "arc" and self.arcs == "native":
+                cx, cy = self.center(last, to, s.ctr.scaled(scale, offset))
+                # clockwise on the page (with y down) is still clockwise once
+                # y is flipped, and that's G2
+                cross = (last.x - cx) * (to.y - cy) - (last.y - cy) * (to.x - cx)
+                g = "G2" if cross > 0 else "G3"
+                i = cx - last.x
+                j = last.y - cy
+                out.append(f"{g} {self.pos(to)} I{_sc(i)} J{_sc(j)}{feed}")
+            elif s.op == "arc":
+                for pt in self.flatten(last, to, s.ctr.scaled(scale, offset)):
+                    out.append(f"G1 {self.pos(pt)}{feed}")
+                    feed = ""
+            else:
+                out.append(f"G1 {self.pos(to)}{feed}")
+            feed = ""
+            last = to
+        out.append("M5")
+        return "\n".join(out) + "\n"
+
+
+# Each outline becomes a closed R12 POLYLINE, with arcs as vertex bulges
+# (the tangent of a quarter of the arc's angle, positive counterclockwise).
+class DXFFormat(ExportFormat):
+    def header(self):
+        return "0\nSECTION\n2\nENTITIES\n"
+
+    def footer(self):
+        return "0\nENDSEC\n0\nEOF\n"
+
+    def vertex(self, pt, bulge=0):
+        x, y = self.xy(pt)
+        v = f"0\nVERTEX\n8\n0\n10\n{_sc(x)}\n20\n{_sc(y)}\n30\n0.0\n"
+        if bulge != 0:
+            v += f"42\n{bulge:.6f}\n"
+        return v
+
+    def format(self, stroke, scale, offset):
+        out = ["0\nPOLYLINE\n8\n0\n66\n1\n70\n1\n"]
+        for s in stroke.segments:
+            fr = s.fr.scaled(scale, offset)
+            to = s.to.scaled(scale, offset)
+            if s.op == "arc" and self.arcs == "native":
+                cx, cy = self.center(fr, to, s.ctr.scaled(scale, offset))
+                ux, uy = fr.x - cx, cy - fr.y
+                vx, vy = to.x - cx, cy - to.y
+                angle = math.atan2(ux * vy - uy * vx, ux * vx + uy * vy)
+                out.append(self.vertex(fr, math.tan(angle / 4)))
+            elif s.op == "arc":
+                out.append(self.vertex(fr))
+                for pt in self.flatten(fr, to, s.ctr.scaled(scale, offset))[:-1]:
+                    out.append(self.vertex(pt))
+            else:
+                out.append(self.vertex(fr))
+        out.append("0\nSEQEND\n8\n0\n")
+        return "".join(out)
+
+
+class ExportDoc(object):
+    def __init__(self, filename, fmt):
+        self.filename = filename
+        self.fmt = fmt
+        self.ofh = None
+        self.written = 0
+
+    def begin(self):
+        self.ofh = open(self.filename, "w")
+        self.add_element(self.fmt.header())
+
+    def add_element(self, text):
+        self.ofh.write(text)
+        self.written += len(text)
+
+    def save(self):
+        self.add_element(self.fmt.footer())
+        self.ofh.close()
+        self.ofh = None
@@ -1,7 +1,21 @@
 import random
 import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import json
 import argparse
+import signal
+import svg
 from svg import Element, SVGDoc
+from spatial import OutlineIndex
+from export import GCodeFormat, DXFFormat, ExportDoc
+import stats
+import preview
+from validate import ValidationReport, OutlineChecker, check_board
+from budget import Budget, OutOfTime, print_progress
 
 DEBUG = False
 
@@ -39,53 +53,43 @@ WEST = Direction(x=-1, y=0)
 #    S2    S1
 
 
+# The shapes of the cells come from a tile file (tiles.json by default).
+# It defines the lattice size, the style constants A/B/C/D for each style,
+# the tween factor for each endcap, the shortcut points above in terms of
+# those constants (S is the lattice size), and for each set of connections
+# (written as in Square.conns) the strokes that draw that cell. Grid compiles
+# it once into a table of segment templates indexed by connection mask, so
+# drawing a cell is just a lookup and an offset.
+TILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiles.json")
+
+
 class Grid(object):
-    def __init__(self, style, endcap):
+    def __init__(self, style, endcap, tilefile=TILE_FILE):
         # the order of these matters later
         self.directions = [NORTH, SOUTH, EAST, WEST]
-        self.size = 12
+        with open(tilefile) as f:
+            tiledef = json.load(f)
+        self.size = tiledef["size"]
         self.S = self.size
-        if style == "thin":
-            self.A = 0
-            self.B = 4
-            self.C = 6
-            self.D = 8
-        if style == "medium":
-            self.A = 0
-            self.B = 3
-            self.C = 6
-            self.D = 9
-        if style == "wide":
-            self.A = 0
-            self.B = 2
-            self.C = 6
-            self.D = 10
-        if endcap == "point":
-            self.tween_factor = 0.01
-        elif endcap == "round":
-            self.tween_factor = 0.5
-        elif endcap == "square":
-            self.tween_factor = 0.99
-        self.setup_shortcuts()
-
-    def setup_shortcuts(self):
+        if style not in tiledef["styles"]:
+            print(f"unknown style {style} in {tilefile}")
+            sys.exit(1)
+        if endcap not in tiledef["endcaps"]:
+            print(f"unknown endcap {endcap} in {tilefile}")
+            sys.exit(1)
+        consts = dict(tiledef["styles"][style])
+        self.A = consts["A"]
+        self.B = consts["B"]
+        self.C = consts["C"]
+        self.D = consts["D"]
+        consts["S"] = self.S
+        self.tween_factor = tiledef["endcaps"][endcap]
+        self.setup_shortcuts(tiledef["shortcuts"], consts)
+        self.compile_tiles(tiledef["tiles"])
+
+    def setup_shortcuts(self, shortcuts, consts):
         self.shortcuts = dict(
-            N1=(self.B, self.A),
-            N2=(self.D, self.A),
-            E1=(self.S, self.B),
-            E2=(self.S, self.D),
-            S1=(self.D, self.S),
-            S2=(self.B, self.S),
-            W1=(self.A, self.D),
-            W2=(self.A, self.B),
-            NC=(self.C, self.B),
-            EC=(self.D, self.C),
-            SC=(self.C, self.D),
-            WC=(self.B, self.C),
-            NW=(self.B, self.B),
-            NE=(self.D, self.B),
-            SW=(self.B, self.D),
-            SE=(self.D, self.D),
+            [(k, (consts[v[0]], consts[v[1]])) for k, v in shortcuts.items()]
         )
 
     def parse(self, cmd, x, y):
@@ -94,6 +98,53 @@ class Grid(object):
         pts = [Point(int(v[0]) + x, int(v[1]) + y) for v in vals]
         return parts[0], pts
 
+    # returns the connection mask for a set of connections written as letters;
+    # the bits follow the order of self.directions
+    def mask(self, conns):
+        m = 0
+        for c in conns:
+            m |= 1 << "NSEW".index(c)
+        return m
+
+    # Builds self.tiles, a list indexed by connection mask. Each entry is a
+    # tuple of strokes, and each stroke is a tuple of segment templates
+    # (op, frx, fry, tox, toy, ctr) with ctr None or an (x, y) pair, all
+    # relative to the corner of the cell.
+    def compile_tiles(self, tiles):
+        self.tiles = [None] * 16
+        for conns, strokes in tiles.items():
+            compiled = []
+            for cmds in strokes:
+                stroke = []
+                for cmd in cmds:
+                    op, pts = self.parse(cmd, 0, 0)
+                    if len(pts) == 3:
+                        ctr = (pts[2].x, pts[2].y)
+                    elif len(pts) == 2:
+                        ctr = None
+                    else:
+                        print(f"wrong number of args in {cmd}")
+                        sys.exit(1)
+                    if len(stroke) > 0 and stroke[-1][3:5] != (pts[0].x, pts[0].y):
+                        print(f"tile {conns} has a gap before {cmd}")
+                        sys.exit(1)
+                    stroke.append((op, pts[0].x, pts[0].y, pts[1].x, pts[1].y, ctr))
+                compiled.append(tuple(stroke))
+            self.tiles[self.mask(conns)] = tuple(compiled)
+        missing = [m for m in range(16) if self.tiles[m] is None]
+        if missing:
+            print(f"tile file has no tiles for connection masks {missing}")
+            sys.exit(1)
+
+    # returns the strokes for the cell at (x, y) with the given connections
+    def cell_strokes(self, mask, x, y):
+        ox = x * self.size
+        oy = y * self.size
+        strokes = []
+        for template in self.tiles[mask]:
+            strokes.append(Stroke(self, x, y).add_template(template, ox, oy))
+        return strokes
+
 
 class Point(object):
     def __init__(self, x, y):
@@ -101,7 +152,7 @@ class Point(object):
         self.y = y
 
     def __hash__(self):
-        return self.x << 16 + self.y
+        return hash((self.x, self.y))
 
     def __eq__(self, __o: object) -> bool:
         return self.x == __o.x and self.y == __o.y
@@ -139,6 +190,17 @@ class Segment(object):
         return self.__str__()
 
 
+# returns true if line b carries on straight from the end of line a
+def _continues(a, b):
+    if a.op != "line" or b.op != "line" or a.to != b.fr:
+        return False
+    ax = a.to.x - a.fr.x
+    ay = a.to.y - a.fr.y
+    bx = b.to.x - b.fr.x
+    by = b.to.y - b.fr.y
+    return ax * by - ay * bx == 0 and ax * bx + ay * by > 0
+
+
 # strokes must be constructed in clockwise order so that they can be joined
 class Stroke(object):
     def __init__(self, grid, x, y):
@@ -168,6 +230,36 @@ class Stroke(object):
             sys.exit(1)
         return self
 
+    # appends segments given as (op, frx, fry, tox, toy, ctr) tuples, where
+    # ctr is None or an (x, y) pair, offset by (ox, oy)
+    def add_template(self, template, ox=0, oy=0):
+        for op, frx, fry, tox, toy, ctr in template:
+            if ctr is not None:
+                ctr = Point(ctr[0] + ox, ctr[1] + oy)
+            self.segments.append(
+                Segment(
+                    op=op,
+                    fr=Point(frx + ox, fry + oy),
+                    to=Point(tox + ox, toy + oy),
+                    ctr=ctr,
+                )
+            )
+        return self
+
+    # the inverse of add_template; plain tuples are cheap to send between processes
+    def template(self):
+        return tuple(
+            (
+                s.op,
+                s.fr.x,
+                s.fr.y,
+                s.to.x,
+                s.to.y,
+                None if s.ctr is None else (s.ctr.x, s.ctr.y),
+            )
+            for s in self.segments
+        )
+
     def fr(self):
         if len(self.segments) == 0:
             return None
@@ -178,9 +270,44 @@ class Stroke(object):
             return None
         return self.segments[-1].to
 
+    # Merges runs of collinear lines (a straight run across several cells is
+    # one line per cell until now) into single lines and drops segments of
+    # zero length, without changing the shape. On a closed outline, a run
+    # that wraps around the start is merged too, by starting the outline at
+    # the beginning of the run.
+    def simplify(self):
+        out = []
+        for s in self.segments:
+            if s.fr == s.to:
+                continue
+            if len(out) > 0 and _continues(out[-1], s):
+                out[-1] = Segment(op="line", fr=out[-1].fr, to=s.to)
+            else:
+                out.append(s)
+        if len(out) > 1 and out[0].fr == out[-1].to and _continues(out[-1], out[0]):
+            out[0] = Segment(op="line", fr=out[-1].fr, to=out[0].to)
+            out.pop()
+        self.segments = out
+        return self
+
+    # returns (x0, y0, x1, y1) in lattice units; arc centers are included
+    # because the curves never leave the box around their endpoints and center
+    def bbox(self):
+        xs = []
+        ys = []
+        for s in self.segments:
+            xs.extend([s.fr.x, s.to.x])
+            ys.extend([s.fr.y, s.to.y])
+            if s.ctr is not None:
+                xs.append(s.ctr.x)
+                ys.append(s.ctr.y)
+        if len(xs) == 0:
+            return None
+        return min(xs), min(ys), max(xs), max(ys)
+
     def generate_path(self, scale, offset):
         # tween factor never hits 0 or 1 because we want the laser head not to stop
-        e = Element(self.fr().scaled(scale, offset), grid.tween_factor)
+        e = Element(self.fr().scaled(scale, offset), self.grid.tween_factor)
         for s in self.segments:
             to = s.to.scaled(scale, offset)
             if s.op == "line":
@@ -197,45 +324,147 @@ class Stroke(object):
         return e.get_path()
 
 
-def optimize_strokes(input):
-    # we make a map of the from point of strokes to the strokes themselves
-    # then we iterate the list of strokes, building a list of strokes where the
-    # from point is the same as the to point; these are the closed strokes.
-    # when all strokes are closed, we're done.
-    strokes = dict([(s.fr(), s) for s in input])
-    closed = []
-    st2 = dict()
-    # take out the already-closed ones first
-    for fr, s in strokes.items():
+# Joins strokes into closed outlines as they arrive. Every open chain is kept
+# in two maps, one by its from point and one by its to point, so a new stroke
+# finds the chain it continues and the chain that continues it in constant
+# time. Strokes are generated row by row, so an outline closes once the rows
+# it reaches are done, and only the outlines crossing the current row are held
+# in memory.
+class StrokeJoiner(object):
+    def __init__(self):
+        self.starts = dict()
+        self.ends = dict()
+
+    # adds a stroke; returns the outline it closed, or None
+    def add(self, s):
+        starts = self.starts
+        ends = self.ends
+        fr = s.fr()
         if s.to() == fr:
-            closed.append(s)
-        else:
-            st2[fr] = s
-
-    # now everything left in st2 should connect to something, so just repeat
-    # until we find them all
-    while len(st2) > 0:
-        # pop one item out of the list
-        fr, s = st2.popitem()
-        # find what it connects to
-        if s.to() not in st2:
-            print(f"ERROR! couldn't find {s.to()} in {st2.keys()}")
-            sys.exit(1)
-        s_to = st2.pop(s.to())
-        # join them
-        s.segments.extend(s_to.segments)
-        if s_to.to() == fr:
-            # if it's closed now, move it to the closed list
+            return s
+        # the chain that ends where this starts, and the one that starts
+        # where this ends
+        before = ends.pop(fr, None)
+        after = starts.pop(s.to(), None)
+        if before is None and after is None:
+            starts[fr] = s
+            ends[s.to()] = s
+            return None
+        if before is after:
+            # this stroke closes the chain
+            before.segments.extend(s.segments)
+            before.segments = list(before.segments)
             if DEBUG:
-                print("adding", s)
-            closed.append(s)
-        else:
-            # put it back
+                print("adding", before)
+            return before
+        if before is not None:
+            del starts[before.fr()]
+        if after is not None:
+            del ends[after.to()]
+        # join before + s + after, growing the longest piece in place so that
+        # each segment is only copied a logarithmic number of times
+        pieces = [p for p in (before, s, after) if p is not None]
+        base = max(range(len(pieces)), key=lambda i: len(pieces[i].segments))
+        joined = pieces[base]
+        # open chains stay deques, so only a new chain is copied into one
+        if not isinstance(joined.segments, deque):
+            joined.segments = deque(joined.segments)
+        for p in reversed(pieces[:base]):
+            joined.segments.extendleft(reversed(p.segments))
+        for p in pieces[base + 1 :]:
+            joined.segments.extend(p.segments)
+        if joined.fr() == joined.to():
+            joined.segments = list(joined.segments)
             if DEBUG:
-                print("extended", s)
-            st2[fr] = s
+                print("adding", joined)
+            return joined
+        if DEBUG:
+            print("extended", joined)
+        starts[joined.fr()] = joined
+        ends[joined.to()] = joined
+        return None
+
+    # returns the chains that haven't closed (yet)
+    def open_strokes(self):
+        strokes = list(self.starts.values())
+        for s in strokes:
+            s.segments = list(s.segments)
+        return strokes
+
+
+# Chains left open at the end are an error; if there's a report they're added
+# to it, otherwise the program stops.
+def _report_open(left, report):
+    if len(left) == 0:
+        return
+    if report is None:
+        print(f"ERROR! couldn't find {left[0].to()} in {[s.fr() for s in left]}")
+        sys.exit(1)
+    for s in left:
+        report.add("unclosed outline", f"from {s.fr()} to {s.to()}")
+
+
+# yields each closed outline as soon as its last piece shows up
+def join_strokes(input, report=None):
+    joiner = StrokeJoiner()
+    for s in input:
+        closed = joiner.add(s)
+        if closed is not None:
+            yield closed
+
+    # everything should have closed by now
+    _report_open(joiner.open_strokes(), report)
+
+
+# Parallel rendering cuts the board into bands of rows. A worker process
+# generates, joins and formats the strokes of one band; the outlines that
+# cross a band boundary come back open and are joined here, in band order,
+# so the output depends on the band size but not on the number of workers.
+_band_grid = None
+
+
+def _init_band_worker(grid, precision):
+    global _band_grid
+    _band_grid = grid
+    svg.set_precision(precision)
+    # the parent's SIGTERM handler only sets a flag in the parent's budget;
+    # a worker should just stop
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+# fmt(stroke, scale, offset) turns a closed outline into the text to write.
+# If validate is set, the band's outlines are checked and the checker comes
+# back too, with its report and the points it saw; outlines that cross bands
+# are checked when they're joined.
+def _render_band(band):
+    rows, y0, scale, offset, fmt, validate = band
+    lookups, misses, _ = svg.sc_cache_stats()
+    joiner = StrokeJoiner()
+    report = None
+    checker = None
+    if validate:
+        report = ValidationReport()
+        size = _band_grid.size
+        checker = OutlineChecker(
+            report, 0, y0 * size, len(rows[0]) * size, (y0 + len(rows)) * size
+        )
+    paths = []
+    for y, row in enumerate(rows, y0):
+        for x, mask in enumerate(row):
+            for s in _band_grid.cell_strokes(mask, x, y):
+                closed = joiner.add(s)
+                if closed is not None:
+                    closed = closed.simplify()
+                    if report is not None:
+                        checker.check(closed)
+                    paths.append(fmt(closed, scale, offset))
+    chains = [s.template() for s in joiner.open_strokes()]
+    after = svg.sc_cache_stats()
+    return paths, chains, (after[0] - lookups, after[1] - misses), checker
 
-    return closed
+
+def optimize_strokes(input):
+    return list(join_strokes(input))
 
 
 class Square(object):
@@ -263,180 +492,25 @@ class Square(object):
     def __str__(self):
         return f"({self.x}, {self.y}) [{self.conns()}]"
 
-    def connect_0(self):
-        if DEBUG:
-            (f"connect_0({self.x}, {self.y})")
-        s = Stroke(self.grid, self.x, self.y)
-        s.add("arc NC EC NE")
-        s.add("arc EC SC SE")
-        s.add("arc SC WC SW")
-        s.add("arc WC NC NW")
-        self.strokes = [s]
-
-    # creates an endcap that connects in the given direction
-    # (so NORTH connects to the square that is north of here)
-    def connect_1(self):
-        if DEBUG:
-            print(f"connect_1({self.x}, {self.y})")
-        conns = self.conns()
-        s = Stroke(self.grid, self.x, self.y)
-        if conns == "N":
-            s.add("line N1 WC")
-            s.add("arc WC SC SW")
-            s.add("arc SC EC SE")
-            s.add("line EC N2")
-        elif conns == "S":
-            s.add("line S1 EC")
-            s.add("arc EC NC NE")
-            s.add("arc NC WC NW")
-            s.add("line WC S2")
-        elif conns == "E":
-            s.add("line E1 NC")
-            s.add("arc NC WC NW")
-            s.add("arc WC SC SW")
-            s.add("line SC E2")
-        elif conns == "W":
-            s.add("line W1 SC")
-            s.add("arc SC EC SE")
-            s.add("arc EC NC NE")
-            s.add("line NC W2")
-
-        self.strokes = [s]
-
-    # draws a square with 2 connections
-    def connect_2(self):
-        if DEBUG:
-            print(f"connect_2({self.x}, {self.y})")
-        self.strokes = []
-        # if we sort them we can handle many fewer cases
-        conns = self.conns()
-        if conns == "NS":
-            # straight up/down
-            self.strokes = [
-                Stroke(self.grid, self.x, self.y).add("line N1 S2"),
-                Stroke(self.grid, self.x, self.y).add("line S1 N2"),
-            ]
-        elif conns == "NE":
-            # outer arc from N to E
-            s = Stroke(self.grid, self.x, self.y)
-            s.add("line N1 WC")
-            s.add("arc WC SC SW")
-            s.add("line SC E2")
-            self.strokes.append(s)
-            # inner arc from E to N
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc E1 N2 NE"))
-        elif conns == "NW":
-            # inner arc from N to W
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc N1 W2 NW"))
-            # outer arc from W to N
-            s = Stroke(self.grid, self.x, self.y)
-            s.add("line W1 SC")
-            s.add("arc SC EC SE")
-            s.add("line EC N2")
-            self.strokes.append(s)
-        elif conns == "SW":
-            # outer arc from S to W
-            s = Stroke(self.grid, self.x, self.y)
-            s.add("line S1 EC")
-            s.add("arc EC NC NE")
-            s.add("line NC W2")
-            self.strokes.append(s)
-            # inner arc from W to S
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc W1 S2 SW"))
-        elif conns == "SE":
-            # inner arc from S to E
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc S1 E2 SE"))
-            # outer arc from E to S
-            s = Stroke(self.grid, self.x, self.y)
-            s.add("line E1 NC")
-            s.add("arc NC WC NW")
-            s.add("line WC S2")
-            self.strokes.append(s)
-        elif conns == "EW":
-            # all that's left is an east-west line
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("line E1 W2"))
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("line W1 E2"))
-        else:
-            print(f"invalid conns in connect_2, {conns}")
-            sys.exit(1)
-
-    # draws a square with 3 connections
-    def connect_3(self):
-        if DEBUG:
-            print(f"connect_3({self.x}, {self.y})")
-        self.strokes = []
-        # this is sorted so we can handle many fewer cases
-        conns = self.conns()
-        if conns == "NSE":
-            # straight NS on the W
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("line N1 S2"))
-            # inner arc from E to N
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc E1 N2 NE"))
-            # inner arc from S to E
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc S1 E2 SE"))
-        elif conns == "NSW":
-            # straight up/down on the E
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("line S1 N2"))
-            # inner arc from N to W
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc N1 W2 NW"))
-            # inner arc from W to S
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc W1 S2 SW"))
-        elif conns == "NEW":
-            # straight EW on the S side
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("line W1 E2"))
-            # inner arc from N to W
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc N1 W2 NW"))
-            # inner arc from E to N
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc E1 N2 NE"))
-        elif conns == "SEW":
-            # straight EW on the N side
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("line E1 W2"))
-            # inner arc from W to S
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc W1 S2 SW"))
-            # inner arc from S to E
-            self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc S1 E2 SE"))
-        else:
-            print(f"invalid conns in connect_3, {conns}")
-            sys.exit(1)
-
-    # draws a square with 4 connections
-    def connect_4(self):
-        if DEBUG:
-            print(f"connect_4({self.x}, {self.y})")
-        self.strokes = []
-        # just 4 arcs
-        # inner arc from N to W
-        self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc N1 W2 NW"))
-        # inner arc from W to S
-        self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc W1 S2 SW"))
-        # inner arc from S to W
-        self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc S1 E2 SE"))
-        # inner arc from W to N
-        self.strokes.append(Stroke(self.grid, self.x, self.y).add("arc E1 N2 NE"))
+    # returns the connections as a bitmask (see Grid.mask)
+    def mask(self):
+        m = 0
+        for i, d in enumerate(self.grid.directions):
+            if d in self.connections:
+                m |= 1 << i
+        return m
 
     def get_strokes(self):
-        n = len(self.connections)
-        if n == 0:
-            # 0 - draw a circle
-            self.connect_0()
-        elif n == 1:
-            # 1 - endcap, 1 line
-            self.connect_1()
-        elif n == 2:
-            # 2 - corner -- 1 large curve, 1 small
-            # 2 - straight -- 2 straight lines
-            self.connect_2()
-        elif n == 3:
-            # 3 - tee -- 1 straight, 2 small curved lines
-            self.connect_3()
-        elif n == 4:
-            # 4 - cross -- 4 small curved lines
-            self.connect_4()
+        self.strokes = self.grid.cell_strokes(self.mask(), self.x, self.y)
         if DEBUG:
             print(self.strokes)
         return self.strokes
 
 
+# The board keeps each cell as a connection mask (see Grid.mask) and an
+# occupied flag in flat bytearrays, indexed by y * width + x, so that boards
+# of millions of cells stay small. board.square(x, y) returns a Square with
+# the same information when an object is more convenient.
 class Board(object):
     def __init__(self, grid, width=20, height=20, neighborhoods=0):
         self.grid = grid
@@ -447,28 +521,123 @@ class Board(object):
             self.neighborhoods = int(self.width * self.height / 5)
         else:
             self.neighborhoods = neighborhoods
+        # the mask bit for each direction, and for its inverse
+        self.bits = dict()
+        for i, d in enumerate(self.grid.directions):
+            self.bits[(d.x, d.y)] = (1 << i, 1 << self.grid.directions.index(d.invert()))
         self.empty_board()
 
     def density(self):
         return self.num_filled / (self.width * self.height)
 
-    def empty_board(self):
-        self.board = []
-        for y in range(self.height):
-            self.board.append([])
-            for x in range(self.width):
-                self.board[y].append(Square(grid, x, y))
+    # the fraction of cells that are occupied
+    def filled(self):
+        return self.occupied.count(1) / (self.width * self.height)
 
-    def generate_lattice(self):
+    def _fill_counts(self):
+        return dict(filled=self.filled())
+
+    def empty_board(self):
+        self.occupied = bytearray(self.width * self.height)
+        self.masks = bytearray(self.width * self.height)
+
+    def square(self, x, y):
+        sq = Square(self.grid, x, y)
+        i = y * self.width + x
+        sq.occupied = bool(self.occupied[i])
+        sq.connections = [
+            d for b, d in enumerate(self.grid.directions) if self.masks[i] & (1 << b)
+        ]
+        return sq
+
+    # The generators take an optional Budget, which they check every few
+    # thousand steps (or every row); it raises OutOfTime when time runs out,
+    # leaving the board as far as it got.
+    def generate_lattice(self, budget=None):
         self.empty_board()
 
+        tries = 0
         while self.num_filled < self.neighborhoods:
+            tries += 1
+            if budget is not None and tries & 4095 == 0:
+                budget.check("lattice", self._fill_counts)
             x = random.randint(0, self.width - 1)
             y = random.randint(0, self.height - 1)
-            if not self.board[y][x].occupied:
-                self.board[y][x].occupied = True
+            if not self.occupied[y * self.width + x]:
+                self.occupied[y * self.width + x] = 1
                 self.num_filled += 1
 
+    # Builds a perfect maze -- a single neighborhood that connects every cell
+    # without loops -- straight into the masks, with a randomized depth-first
+    # search. It walks from the current cell to a random unvisited neighbor
+    # until it gets stuck, then backs up along an explicit stack to the last
+    # cell that had a choice of ways to go; every cell is reached once, so
+    # it's linear in the number of cells.
+    def generate_maze(self, budget=None):
+        w = self.width
+        h = self.height
+        # work on a copy with a border of cells that are already visited, so
+        # the inner loop needs no bounds checks; visited cells are the ones
+        # with a nonzero mask, and the border and start cells get a bit that
+        # isn't a direction
+        pw = w + 2
+        m = bytearray(pw * (h + 2))
+        for x in range(pw):
+            m[x] = 16
+            m[(h + 1) * pw + x] = 16
+        for y in range(h + 2):
+            m[y * pw] = 16
+            m[y * pw + pw - 1] = 16
+        start = (random.randrange(h) + 1) * pw + random.randrange(w) + 1
+        m[start] = 16
+        # (step, bit for this cell, bit for the neighbor) in each direction
+        north = (-pw, 1, 2)
+        south = (pw, 2, 1)
+        east = (1, 4, 8)
+        west = (-1, 8, 4)
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        rnd = random.random
+        c = start
+        carved = 0
+        while True:
+            opts = []
+            if not m[c - pw]:
+                opts.append(north)
+            if not m[c + pw]:
+                opts.append(south)
+            if not m[c + 1]:
+                opts.append(east)
+            if not m[c - 1]:
+                opts.append(west)
+            k = len(opts)
+            if k == 0:
+                if not stack:
+                    break
+                c = pop()
+                continue
+            if k == 1:
+                step, bit, inverse = opts[0]
+            else:
+                # come back here later for the other ways out
+                step, bit, inverse = opts[int(rnd() * k)]
+                push(c)
+            m[c] |= bit
+            c += step
+            m[c] = inverse
+            carved += 1
+            if budget is not None and carved & 65535 == 0:
+                # the masks are only copied to the board at the end
+                budget.check("maze", dict(carved=carved / (w * h)))
+        m[start] &= 15
+
+        self.masks = bytearray()
+        for y in range(1, h + 1):
+            self.masks += m[y * pw + 1 : y * pw + 1 + w]
+        self.occupied = bytearray(b"\x01") * (w * h)
+        self.num_filled = w * h
+
     def can_connect(self, x, y, dir):
         nx = x + dir.x
         ny = y + dir.y
@@ -476,7 +645,7 @@ class Board(object):
             return False
         if ny < 0 or ny >= self.height:
             return False
-        if not self.board[ny][nx].occupied:
+        if not self.occupied[ny * self.width + nx]:
             return False
         return True
 
@@ -484,10 +653,13 @@ class Board(object):
         # print(
         #     f"connecting ({x}, {y}) to ({x + dir.x}, {y + dir.y}) D{dir} I{dir.invert()}"
         # )
-        self.board[y][x].occupied = True
-        self.board[y][x].connections.append(dir)
-        self.board[y + dir.y][x + dir.x].occupied = True
-        self.board[y + dir.y][x + dir.x].connections.append(dir.invert())
+        bit, inverse = self.bits[(dir.x, dir.y)]
+        i = y * self.width + x
+        j = (y + dir.y) * self.width + x + dir.x
+        self.occupied[i] = 1
+        self.masks[i] |= bit
+        self.occupied[j] = 1
+        self.masks[j] |= inverse
         self.num_filled += 1
 
     # Given a coordinate of an empty square, tries to connect it to a
@@ -497,19 +669,26 @@ class Board(object):
         trial_order = sorted(self.grid.directions, key=lambda a: random.random())
         for dir in trial_order:
             if self.can_connect(x, y, dir):
-                assert self.board[y][x].occupied == False
-                assert dir not in self.board[y][x].connections
-                assert dir.invert() not in self.board[y + dir.y][x + dir.x].connections
+                bit, inverse = self.bits[(dir.x, dir.y)]
+                i = y * self.width + x
+                j = (y + dir.y) * self.width + x + dir.x
+                assert self.occupied[i] == 0
+                assert not self.masks[i] & bit
+                assert not self.masks[j] & inverse
                 self.connect(x, y, dir)
                 return True
         return False
 
-    def fill_board_randomly(self):
+    def fill_board_randomly(self, budget=None):
         failures = 0
+        tries = 0
         while self.density() < 0.9 or failures < 10:
+            tries += 1
+            if budget is not None and tries & 4095 == 0:
+                budget.check("random fill", self._fill_counts)
             x = random.randint(0, self.width - 1)
             y = random.randint(0, self.height - 1)
-            if self.board[y][x].occupied:
+            if self.occupied[y * self.width + x]:
                 failures += 1
                 continue
             if not self.try_connect(x, y):
@@ -518,83 +697,326 @@ class Board(object):
             failures = 0
 
     def erase_solo_squares(self):
-        for y in range(self.height):
-            for x in range(self.width):
-                if len(self.board[y][x].connections) == 0:
-                    self.board[y][x].occupied = 0
+        for i in range(self.width * self.height):
+            if self.masks[i] == 0:
+                self.occupied[i] = 0
 
-    def fill_board_iteratively(self):
+    def fill_board_iteratively(self, budget=None):
         done = False
         while not done:
             done = True
             for y in range(self.height):
+                if budget is not None:
+                    budget.check("fill", self._fill_counts)
                 for x in range(self.width):
-                    if self.board[y][x].occupied:
+                    if self.occupied[y * self.width + x]:
                         continue
                     if not self.try_connect(x, y):
                         done = False
 
     def print_board(self):
+        n, s, e, w = [self.bits[(d.x, d.y)][0] for d in (NORTH, SOUTH, EAST, WEST)]
         for y in range(self.height):
-            squares = [self.board[y][x] for x in range(self.width)]
-            for sq in squares:
-                print(f" {NORTH in sq.connections and '|' or ' '} ", end="")
+            row = range(y * self.width, (y + 1) * self.width)
+            for i in row:
+                print(f" {self.masks[i] & n and '|' or ' '} ", end="")
             print()
-            for sq in squares:
+            for i in row:
                 print(
-                    f"{WEST in sq.connections and '-' or ' '}{sq.occupied and '+' or ' '}{EAST in sq.connections and '-' or ' '}",
+                    f"{self.masks[i] & w and '-' or ' '}{self.occupied[i] and '+' or ' '}{self.masks[i] & e and '-' or ' '}",
                     end="",
                 )
             print()
-            for sq in squares:
-                print(f" {SOUTH in sq.connections and '|' or ' '} ", end="")
+            for i in row:
+                print(f" {self.masks[i] & s and '|' or ' '} ", end="")
             print()
 
+    # writes a PNG thumbnail painted straight from the connection masks,
+    # with scale pixels per cell, which can be a fraction (needs numpy)
+    def save_preview(self, filename, scale=4):
+        img = preview.render(
+            self.masks, self.occupied, self.width, self.height, self.grid, scale
+        )
+        if img is None:
+            print(f"can't draw a preview at {scale} pixels per cell")
+            sys.exit(1)
+        preview.write_png(filename, img)
+
     def print_cells(self):
         for y in range(self.height):
             for x in range(self.width):
-                sq = self.board[y][x]
-                if sq.occupied:
-                    print(sq)
+                if self.occupied[y * self.width + x]:
+                    print(self.square(x, y))
 
     def drawCell(self, x, y):
         # possible cells by the edges they connect with:
         # N, S, E, W,
         pass
 
+    # yields the strokes of every cell, row by row, without keeping them;
+    # the budget, if any, is checked every row
+    def iter_strokes(self, budget=None):
+        for y, row in enumerate(self.mask_rows()):
+            if budget is not None:
+                budget.check("join", lambda: dict(joined=y / self.height))
+            for x, mask in enumerate(row):
+                yield from self.grid.cell_strokes(mask, x, y)
+
+    # yields closed, simplified outlines as they're completed; if there's a
+    # report, they're checked on the way
+    def iter_closed_strokes(self, report=None, budget=None):
+        strokes = (
+            s.simplify() for s in join_strokes(self.iter_strokes(budget), report)
+        )
+        if report is None:
+            return strokes
+        return self.outline_checker(report).checked(strokes)
+
     def generate_strokes(self):
-        all_strokes = []
-        for y in range(self.height):
-            for x in range(self.width):
-                sq = self.board[y][x]
-                all_strokes.extend(sq.get_strokes())
-        closed = optimize_strokes(all_strokes)
-        return closed
+        return list(self.iter_closed_strokes())
+
+    # checks the connections and occupancy of the board; returns the report
+    def validate(self, report=None):
+        if report is None:
+            report = ValidationReport()
+        check_board(self.masks, self.occupied, self.width, self.height, report)
+        return report
+
+    # returns a checker for outlines anywhere on the board
+    def outline_checker(self, report):
+        size = self.grid.size
+        return OutlineChecker(report, 0, 0, self.width * size, self.height * size)
+
+    # returns the connection masks of the board, one bytes object per row
+    def mask_rows(self):
+        w = self.width
+        return [bytes(self.masks[y * w : (y + 1) * w]) for y in range(self.height)]
+
+    # yields every closed outline formatted by fmt(stroke, scale, offset),
+    # rendering bands of bandrows rows in a pool of jobs processes
+    def iter_formatted_parallel(
+        self, fmt, scale, offset, jobs, bandrows, report=None, budget=None
+    ):
+        rows = self.mask_rows()
+        validate = report is not None
+        bands = [
+            (rows[y : y + bandrows], y, scale, offset, fmt, validate)
+            for y in range(0, self.height, bandrows)
+        ]
+        if validate:
+            checker = self.outline_checker(report)
+        joiner = StrokeJoiner()
+        pool = ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_band_worker,
+            initargs=(self.grid, svg.get_precision()),
+        )
+        done = 0
+        try:
+            try:
+                # the bands are submitted one by one rather than with map, so
+                # that stopping early doesn't cancel them behind the pool's back
+                futures = [pool.submit(_render_band, band) for band in bands]
+                for future in futures:
+                    paths, chains, cache_stats, band_checker = future.result()
+                    if budget is not None:
+                        budget.check("join", dict(joined=done / len(bands)))
+                    done += 1
+                    svg.add_sc_cache_stats(*cache_stats)
+                    if band_checker is not None:
+                        # points shared with other bands' outlines show up here
+                        report.merge(band_checker.report)
+                        checker.merge(band_checker)
+                    yield from paths
+                    for chain in chains:
+                        closed = joiner.add(
+                            Stroke(self.grid, 0, 0).add_template(chain)
+                        )
+                        if closed is not None:
+                            closed = closed.simplify()
+                            if validate:
+                                checker.check(closed)
+                            yield fmt(closed, scale, offset)
+            except BrokenProcessPool:
+                # a SIGTERM sent to the whole process group kills the workers
+                # and cancels the budget; that's a stop, not a crash
+                if budget is not None:
+                    budget.check("join", dict(joined=done / len(bands)))
+                raise
+        except BaseException:
+            # stopped early (out of time, or the caller stopped reading): stop
+            # the workers, which fails the bands that haven't finished
+            for w in list((pool._processes or {}).values()):
+                w.terminate()
+            pool.shutdown()
+            raise
+        pool.shutdown()
+        _report_open(joiner.open_strokes(), report)
+
+    # yields every closed outline formatted by fmt(stroke, scale, offset), in
+    # the order they close, either from strokes or rendered in parallel.
+    # Outlines are checked into report if there is one, unless they were
+    # given (and so were checked when they were made).
+    def iter_formatted(
+        self,
+        strokes,
+        fmt,
+        scale,
+        offset,
+        jobs=1,
+        bandrows=64,
+        report=None,
+        budget=None,
+    ):
+        if jobs > 1 and strokes is None:
+            return self.iter_formatted_parallel(
+                fmt, scale, offset, jobs, bandrows, report, budget
+            )
+        if strokes is None:
+            strokes = self.iter_closed_strokes(report, budget)
+        return (fmt(s, scale, offset) for s in strokes)
+
+    # builds a spatial index over closed outlines, with one bucket per cell
+    def outline_index(self, strokes):
+        return OutlineIndex(strokes, self.grid.size)
+
+    # Works out the page: returns (strokes, pagewidth, pageheight, offset).
+    # crop is a rectangle (x0, y0, x1, y1) in cell coordinates; if it's given,
+    # strokes is the list of outlines that cross it, and the page is just big
+    # enough to hold them. Otherwise strokes is None, and the outlines are
+    # generated as they're written.
+    def layout(
+        self,
+        gridsize,
+        cellsize,
+        width,
+        height,
+        bordersize,
+        crop=None,
+        report=None,
+        budget=None,
+    ):
+        size = cellsize * gridsize
+        pagewidth = size * width + 2 * bordersize + 2
+        pageheight = size * height + 2 * bordersize + 2
+        offset = Point(bordersize + 1, bordersize + 1)
+        if crop is None:
+            return None, pagewidth, pageheight, offset
+        # cropping needs every outline up front to index them
+        index = self.outline_index(self.iter_closed_strokes(report, budget))
+        x0, y0, x1, y1 = [c * gridsize for c in crop]
+        strokes = index.query(x0, y0, x1, y1)
+        print(f"cropping to {crop}: {len(strokes)} of {len(index)} outlines")
+        box = index.bbox(strokes) or (x0, y0, x0, y0)
+        pagewidth = (box[2] - box[0]) * cellsize + 2 * bordersize + 2
+        pageheight = (box[3] - box[1]) * cellsize + 2 * bordersize + 2
+        offset = Point(
+            bordersize + 1 - box[0] * cellsize, bordersize + 1 - box[1] * cellsize
+        )
+        return strokes, pagewidth, pageheight, offset
 
     def save_svg(
-        self, filename, gridsize, cellsize, width, height, bordersize, fillcolor
+        self,
+        filename,
+        gridsize,
+        cellsize,
+        width,
+        height,
+        bordersize,
+        fillcolor,
+        crop=None,
+        jobs=1,
+        bandrows=64,
+        report=None,
+        budget=None,
     ):
         print(
             f"writing {width}x{height} grid to "
             f"{filename} with "
             f"cellsize {cellsize} and border {bordersize}"
         )
-        strokes = self.generate_strokes()
+        strokes, pagewidth, pageheight, offset = self.layout(
+            gridsize, cellsize, width, height, bordersize, crop, report, budget
+        )
         doc = SVGDoc(filename)
-        size = cellsize * gridsize
-        pagewidth = size * width + 2 * bordersize + 2
-        pageheight = size * height + 2 * bordersize + 2
         doc.setPageSize([pagewidth, pageheight])
         doc.setAuthor("Lattice Generator")
         doc.setFillColor(fillcolor)
+        # write each outline as soon as it's closed rather than holding them all
+        doc.begin()
         doc.draw_rect(1, 1, pagewidth - 2, pageheight - 2)
-        for s in strokes:
-            if DEBUG:
-                print("  S:", s)
-            path = s.generate_path(cellsize, Point(bordersize + 1, bordersize + 1))
-            if DEBUG:
-                print("  P:", path)
-            doc.draw_element(path)
+        paths = self.iter_formatted(
+            strokes,
+            Stroke.generate_path,
+            cellsize,
+            offset,
+            jobs,
+            bandrows,
+            report,
+            budget,
+        )
+        self.write_outlines(doc, paths, doc.draw_element, budget)
+
+    # writes G-code or DXF straight from the outlines; arcs is "native" to
+    # write arcs as arcs, or "lines" to flatten them the way the svg draws them
+    def save_export(
+        self,
+        filename,
+        format,
+        gridsize,
+        cellsize,
+        width,
+        height,
+        bordersize,
+        crop=None,
+        jobs=1,
+        bandrows=64,
+        arcs="native",
+        feed=1000,
+        report=None,
+        budget=None,
+    ):
+        print(
+            f"writing {width}x{height} grid to "
+            f"{filename} as {format} with "
+            f"cellsize {cellsize} and border {bordersize}"
+        )
+        strokes, pagewidth, pageheight, offset = self.layout(
+            gridsize, cellsize, width, height, bordersize, crop, report, budget
+        )
+        if format == "gcode":
+            fmt = GCodeFormat(pageheight, self.grid.tween_factor, arcs, feed=feed)
+        elif format == "dxf":
+            fmt = DXFFormat(pageheight, self.grid.tween_factor, arcs)
+        else:
+            print(f"unknown export format {format}")
+            sys.exit(1)
+        doc = ExportDoc(filename, fmt)
+        doc.begin()
+        texts = self.iter_formatted(
+            strokes, fmt.format, cellsize, offset, jobs, bandrows, report, budget
+        )
+        self.write_outlines(doc, texts, doc.add_element, budget)
+
+    # writes each formatted outline with draw and finishes the file; if the
+    # budget runs out, the file is finished with the outlines written so far.
+    # The budget is checked before each outline is drawn, so a stop always
+    # leaves something out.
+    def write_outlines(self, doc, texts, draw, budget=None):
+        n = 0
+        try:
+            for text in texts:
+                if budget is not None:
+                    budget.check("render", lambda: dict(outlines=n, bytes=doc.written))
+                if DEBUG:
+                    print("  P:", text)
+                draw(text)
+                n += 1
+        except OutOfTime as e:
+            texts.close()
+            doc.save()
+            e.written = n
+            raise
         doc.save()
 
 
@@ -652,8 +1074,36 @@ if __name__ == "__main__":
     parser.add_argument(
         "--filename",
         dest="filename",
-        default="lattice.svg",
-        help="filename in which to store the resulting svg (lattice.svg)",
+        default=None,
+        help="filename in which to store the result (lattice.svg, lattice.gcode or lattice.dxf)",
+    )
+    parser.add_argument(
+        "--format",
+        dest="format",
+        default="svg",
+        choices=["svg", "gcode", "dxf"],
+        help="the output format (svg)",
+    )
+    parser.add_argument(
+        "--arcs",
+        dest="arcs",
+        default="native",
+        choices=["native", "lines"],
+        help="write gcode and dxf arcs as arcs, or as short lines following the svg curves (native)",
+    )
+    parser.add_argument(
+        "--feed",
+        dest="feed",
+        type=int,
+        default=1000,
+        help="the gcode feed rate in mm/min (1000)",
+    )
+    parser.add_argument(
+        "--precision",
+        dest="precision",
+        type=int,
+        default=1,
+        help="the number of decimals written for coordinates (1)",
     )
     parser.add_argument(
         "--fillcolor",
@@ -673,44 +1123,227 @@ if __name__ == "__main__":
         "--style",
         dest="style",
         default="medium",
-        choices=["wide", "medium", "thin"],
-        help="style of the strokes (medium)",
+        help="style of the strokes, as named in the tile file: wide, medium or thin (medium)",
     )
     parser.add_argument(
         "--endcap",
         dest="endcap",
         default="round",
-        choices=["point", "round", "square"],
-        help="style of the endcaps (round)",
+        help="style of the endcaps, as named in the tile file: point, round or square (round)",
+    )
+    parser.add_argument(
+        "--tiles",
+        dest="tiles",
+        default=TILE_FILE,
+        help="the tile file that defines the cell shapes (tiles.json)",
+    )
+    parser.add_argument(
+        "--crop",
+        dest="crop",
+        type=str,
+        default=None,
+        help="only write the outlines crossing the cell rectangle X0,Y0,X1,Y1",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="the number of processes used to render the svg (1)",
+    )
+    parser.add_argument(
+        "--bandrows",
+        dest="bandrows",
+        type=int,
+        default=64,
+        help="the number of rows in each band rendered by one process (64)",
+    )
+    parser.add_argument(
+        "--preview",
+        dest="preview",
+        default=None,
+        help="also write a png thumbnail of the board to this file (needs numpy)",
+    )
+    parser.add_argument(
+        "--previewscale",
+        dest="previewscale",
+        type=float,
+        default=4,
+        help="the number of preview pixels per cell, which can be a fraction such as 0.25 (4)",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        default=False,
+        action="store_true",
+        help="print the time taken by each phase and the number cache hit rate",
+    )
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        type=int,
+        default=0,
+        help="instead of drawing, simulate this many boards and print neighborhood statistics (needs numpy)",
+    )
+    parser.add_argument(
+        "--validate",
+        dest="validate",
+        default=False,
+        action="store_true",
+        help="check the board and its outlines while drawing, and print a report",
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        default=None,
+        help="stop with exit status 2 if generating and writing take longer than this many seconds",
+    )
+    parser.add_argument(
+        "--progress",
+        dest="progress",
+        default=False,
+        action="store_true",
+        help="print progress every second",
     )
 
     args = parser.parse_args()
 
+    if args.stats > 0:
+        if stats.np is None:
+            print("--stats needs numpy")
+            sys.exit(1)
+        results = stats.simulate(
+            args.width,
+            args.height,
+            neighborhoods=args.n,
+            nosolo=args.nosolo,
+            runs=args.stats,
+            seed=args.seed,
+        )
+        stats.print_statistics(results)
+        sys.exit(0)
+
+    crop = None
+    if args.crop is not None:
+        crop = [int(c) for c in args.crop.split(",")]
+        if len(crop) != 4:
+            print(f"--crop needs 4 values, got {args.crop}")
+            sys.exit(1)
+    if args.jobs < 1:
+        print(f"--jobs must be at least 1, got {args.jobs}")
+        sys.exit(1)
+    if args.previewscale <= 0:
+        print(f"--previewscale must be more than 0, got {args.previewscale}")
+        sys.exit(1)
+    if args.bandrows < 1:
+        print(f"--bandrows must be at least 1, got {args.bandrows}")
+        sys.exit(1)
+
     if args.seed != 0:
         random.seed(args.seed)
-    grid = Grid(args.style, args.endcap)
+    # there's always a budget, even with no time limit, so that a scheduler
+    # stopping the job with SIGTERM gets the same clean stop as a timeout
+    budget = Budget(args.timeout, print_progress if args.progress else None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: budget.cancel())
+    started = time.perf_counter()
+    grid = Grid(args.style, args.endcap, args.tiles)
     drawing = Board(
         grid=grid, width=args.width, height=args.height, neighborhoods=args.n
     )
-    drawing.generate_lattice()
-    drawing.fill_board_randomly()
-    if args.nosolo:
-        drawing.erase_solo_squares()
-    drawing.fill_board_iteratively()
+    try:
+        if drawing.neighborhoods == 1:
+            # a single neighborhood is a perfect maze, which has its own engine
+            drawing.generate_maze(budget)
+        else:
+            drawing.generate_lattice(budget)
+            drawing.fill_board_randomly(budget)
+            if args.nosolo:
+                drawing.erase_solo_squares()
+            drawing.fill_board_iteratively(budget)
+    except OutOfTime as e:
+        print(f"stopped: {e}; nothing was written")
+        sys.exit(2)
+    generated = time.perf_counter()
+    report = None
+    if args.validate:
+        report = drawing.validate()
     if args.printboard:
         drawing.print_board()
+    if args.preview is not None:
+        if preview.np is None:
+            print("--preview needs numpy")
+            sys.exit(1)
+        drawing.save_preview(args.preview, args.previewscale)
     # drawing.print_cells()
 
     # strokes = drawing.generate_strokes()
     # for s in strokes:
     #     print("  :", s)
 
-    drawing.save_svg(
-        args.filename,
-        grid.size,
-        args.cellsize,
-        args.width,
-        args.height,
-        args.bordersize,
-        args.fillcolor,
-    )
+    if args.filename is None:
+        args.filename = "lattice." + args.format
+    svg.set_precision(args.precision)
+    try:
+        if args.format == "svg":
+            drawing.save_svg(
+                args.filename,
+                grid.size,
+                args.cellsize,
+                args.width,
+                args.height,
+                args.bordersize,
+                args.fillcolor,
+                crop,
+                args.jobs,
+                args.bandrows,
+                report,
+                budget,
+            )
+        else:
+            drawing.save_export(
+                args.filename,
+                args.format,
+                grid.size,
+                args.cellsize,
+                args.width,
+                args.height,
+                args.bordersize,
+                crop,
+                args.jobs,
+                args.bandrows,
+                args.arcs,
+                args.feed,
+                report,
+                budget,
+            )
+    except OutOfTime as e:
+        if e.written is None:
+            print(f"stopped: {e}; nothing was written")
+        elif e.written == 0:
+            print(f"stopped: {e}; {args.filename} has no outlines")
+        else:
+            print(
+                f"stopped: {e}; {args.filename} has only the "
+                f"{e.written} outlines written so far"
+            )
+        sys.exit(2)
+
+    if args.profile:
+        rendered = time.perf_counter()
+        print(
+            f"profile: generate {generated - started:.3f}s, "
+            f"render {rendered - generated:.3f}s"
+        )
+        lookups, misses, entries = svg.sc_cache_stats()
+        print(
+            f"profile: number cache {entries} entries, "
+            f"{(lookups - misses) / max(1, lookups):.1%} hits "
+            f"({lookups - misses} of {lookups} lookups)"
+        )
+
+    if report is not None:
+        print(report)
+        if not report.ok():
+            sys.exit(1)
@@ -0,0 +1,128 @@
+# Raster previews of boards.
+
+# Rendering the full SVG and opening it in a viewer is slow for big boards, so this paints a PNG thumbnail straight
+# from the connection masks instead. Each of the 16 connection masks gets a small square sprite (the cell's band,
+# plus an arm out to each edge it connects through), and the whole picture is one NumPy fancy-indexing operation that
+# looks up the sprite of every cell at once. The PNG is written with zlib, so there's nothing to install beyond numpy.
+
+# A sprite needs a few pixels for the band to sit clear of the cell's edges; with fewer, every sprite is solid. So a
+# preview with fewer pixels per cell than that (down to a fraction of a pixel per cell) is painted at a scale where the
+# sprites are distinct, and then shrunk by averaging blocks of pixels, a strip of rows at a time so that the full-size
+# picture is never held in memory.
+
+import math
+
+import struct
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INK = 0
+PAPER = 255
+# the sprite index used for cells that aren't occupied
+EMPTY = 16
+
+
+# Returns an array of 17 sprites of cellpx x cellpx pixels: one for each
+# connection mask, and a blank one for empty cells. The band runs from B to D
+# of the grid's size, like the strokes do.
+def sprites(grid, cellpx):
+    lo = min(cellpx - 1, int(round(grid.B * cellpx / grid.size)))
+    hi = max(lo + 1, int(round(grid.D * cellpx / grid.size)))
+    tiles = np.full((EMPTY + 1, cellpx, cellpx), PAPER, dtype=np.uint8)
+    for mask in range(16):
+        t = tiles[mask]
+        t[lo:hi, lo:hi] = INK
+        # the bits follow the order of grid.directions: N, S, E, W
+        if mask & 1:
+            t[:hi, lo:hi] = INK
+        if mask & 2:
+            t[lo:, lo:hi] = INK
+        if mask & 4:
+            t[lo:hi, lo:] = INK
+        if mask & 8:
+            t[lo:hi, :hi] = INK
+    return tiles
+
+
+# the largest sprite size tried when looking for one that shows the cells
+MAX_CELLPX = 64
+
+
+# returns true if the sprites at this size are all different
+def distinct(grid, cellpx):
+    tiles = sprites(grid, cellpx)
+    return len({t.tobytes() for t in tiles}) == len(tiles)
+
+
+# Works out how to draw scale pixels per cell: returns (cellpx, block), where
+# cells are painted with sprites of cellpx pixels and then blocks of
+# block x block pixels are averaged, so that cellpx / block == scale.
+def paint_scale(grid, scale):
+    for cellpx in range(1, MAX_CELLPX + 1):
+        block = int(round(cellpx / scale))
+        if block >= 1 and abs(cellpx / block - scale) < 1e-9 and distinct(grid, cellpx):
+            return cellpx, block
+    return None
+
+
+def _paint(index, tiles, cellpx):
+    rows, cols = index.shape
+    # (rows, cols, cellpx, cellpx) -> rows of pixels
+    img = tiles[index]
+    return img.transpose(0, 2, 1, 3).reshape(rows * cellpx, cols * cellpx)
+
+
+# Returns a grayscale image of the board at scale pixels per cell, which can
+# be less than one; the image is rounded up to whole pixels, and the parts
+# past the board are paper. Returns None if no sprite size up to MAX_CELLPX
+# gives that scale.
+def render(masks, occupied, width, height, grid, scale=4):
+    found = paint_scale(grid, scale)
+    if found is None:
+        return None
+    cellpx, block = found
+    tiles = sprites(grid, cellpx)
+    cells = np.frombuffer(masks, dtype=np.uint8).reshape(height, width)
+    filled = np.frombuffer(occupied, dtype=np.uint8).reshape(height, width)
+    index = np.where(filled != 0, cells, EMPTY)
+    if block == 1:
+        return _paint(index, tiles, cellpx)
+    # pad the board with empty cells so that the blocks fit, then shrink
+    # strips of cell rows whose height is a whole number of blocks
+    step = block // math.gcd(cellpx, block)
+    padw = -width % step
+    padh = -height % step
+    index = np.pad(index, ((0, padh), (0, padw)), constant_values=EMPTY)
+    strip = step * max(1, 256 // step)
+    outw = (width + padw) * cellpx // block
+    parts = []
+    for y in range(0, height + padh, strip):
+        img = _paint(index[y : y + strip], tiles, cellpx).astype(np.uint32)
+        h = img.shape[0] // block
+        img = img.reshape(h, block, outw, block).sum(axis=(1, 3))
+        parts.append((img // (block * block)).astype(np.uint8))
+    img = np.concatenate(parts)
+    return img[: math.ceil(height * scale), : math.ceil(width * scale)]
+
+
+def _chunk(kind, data):
+    body = kind + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+
+# writes an 8-bit grayscale image as a PNG; the compression level is low
+# because previews are about speed
+def write_png(filename, img, level=1):
+    h, w = img.shape
+    # every row starts with a filter type byte, 0 for none
+    raw = np.zeros((h, w + 1), dtype=np.uint8)
+    raw[:, 1:] = img
+    with open(filename, "wb") as ofh:
+        ofh.write(b"\x89PNG\r\n\x1a\n")
+        ofh.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 0, 0, 0, 0)))
+        ofh.write(_chunk(b"IDAT", zlib.compress(raw.tobytes(), level)))
+        ofh.write(_chunk(b"IEND", b""))
@@ -0,0 +1,190 @@
+# Spatial index over closed outlines.
+
+# Once the strokes have been joined into closed outlines they are just an unordered list, so anything that
+# only cares about one region of the board (cropping, checking a defect in the material, tiling) would have
+# to rescan all of them. This builds a uniform grid of buckets over the outline segments so that region
+# queries and nearest-outline lookups only look at the buckets around the area of interest.
+
+# Everything here works in lattice units (the same units as the stroke points, before scaling), and only
+# needs the segments to have op, fr, to and ctr attributes.
+
+import math
+
+
+def _seg_box(seg):
+    "returns the bounding box of a segment as (x0, y0, x1, y1)"
+    xs = [seg.fr.x, seg.to.x]
+    ys = [seg.fr.y, seg.to.y]
+    if seg.ctr is not None:
+        # the curve stays inside the hull of its endpoints and the corner
+        # where their tangents meet
+        xs.append(seg.ctr.x)
+        ys.append(seg.ctr.y)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _overlaps(box, x0, y0, x1, y1):
+    return box[0] < x1 and box[2] > x0 and box[1] < y1 and box[3] > y0
+
+
+def _line_distance(ax, ay, bx, by, x, y):
+    dx = bx - ax
+    dy = by - ay
+    d2 = dx * dx + dy * dy
+    if d2 == 0:
+        return math.hypot(x - ax, y - ay)
+    t = max(0, min(1, ((x - ax) * dx + (y - ay) * dy) / d2))
+    return math.hypot(x - (ax + t * dx), y - (ay + t * dy))
+
+
+def segment_distance(seg, x, y):
+    "returns the distance from (x, y) to a line or quarter-arc segment"
+    if seg.op != "arc" or seg.ctr is None:
+        return _line_distance(seg.fr.x, seg.fr.y, seg.to.x, seg.to.y, x, y)
+    # arcs are quarter circles; ctr is where the tangents at the two ends
+    # meet, so the center of the circle is the opposite corner of the square
+    # they make. If the point is inside the sector spanned by the two radii,
+    # the closest point is on the arc itself, otherwise it's one of the ends.
+    cx = seg.fr.x + seg.to.x - seg.ctr.x
+    cy = seg.fr.y + seg.to.y - seg.ctr.y
+    ux, uy = seg.fr.x - cx, seg.fr.y - cy
+    vx, vy = seg.to.x - cx, seg.to.y - cy
+    px, py = x - cx, y - cy
+    if px * ux + py * uy >= 0 and px * vx + py * vy >= 0:
+        return abs(math.hypot(px, py) - math.hypot(ux, uy))
+    return min(
+        math.hypot(x - seg.fr.x, y - seg.fr.y),
+        math.hypot(x - seg.to.x, y - seg.to.y),
+    )
+
+
+class OutlineIndex(object):
+    # bucketsize is in lattice units; one cell (grid.size) is a good choice
+    # because the segments generated by a cell never leave it.
+    def __init__(self, strokes, bucketsize):
+        self.bucketsize = bucketsize
+        self.strokes = []
+        self.boxes = []
+        self.buckets = dict()
+        self.extent = None
+        for s in strokes:
+            self.add(s)
+
+    def __len__(self):
+        return len(self.strokes)
+
+    def _bucket_range(self, lo, hi):
+        return range(
+            int(math.floor(lo / self.bucketsize)),
+            int(math.floor(hi / self.bucketsize)) + 1,
+        )
+
+    def add(self, stroke):
+        oid = len(self.strokes)
+        self.strokes.append(stroke)
+        box = None
+        for seg in stroke.segments:
+            sb = _seg_box(seg)
+            if box is None:
+                box = list(sb)
+            else:
+                box = [
+                    min(box[0], sb[0]),
+                    min(box[1], sb[1]),
+                    max(box[2], sb[2]),
+                    max(box[3], sb[3]),
+                ]
+            for by in self._bucket_range(sb[1], sb[3]):
+                for bx in self._bucket_range(sb[0], sb[2]):
+                    self.buckets.setdefault((bx, by), []).append((oid, seg, sb))
+        self.boxes.append(tuple(box) if box is not None else None)
+        if box is not None:
+            bx0 = self._bucket_range(box[0], box[0])[0]
+            by0 = self._bucket_range(box[1], box[1])[0]
+            bx1 = self._bucket_range(box[2], box[2])[0]
+            by1 = self._bucket_range(box[3], box[3])[0]
+            if self.extent is None:
+                self.extent = [bx0, by0, bx1, by1]
+            else:
+                self.extent = [
+                    min(self.extent[0], bx0),
+                    min(self.extent[1], by0),
+                    max(self.extent[2], bx1),
+                    max(self.extent[3], by1),
+                ]
+        return oid
+
+    def bbox(self, strokes=None):
+        "returns the bounding box of the given outlines (or all of them)"
+        if strokes is None:
+            boxes = [b for b in self.boxes if b is not None]
+        else:
+            boxes = [s.bbox() for s in strokes]
+        if len(boxes) == 0:
+            return None
+        return (
+            min(b[0] for b in boxes),
+            min(b[1] for b in boxes),
+            max(b[2] for b in boxes),
+            max(b[3] for b in boxes),
+        )
+
+    # Returns the outlines that have at least one segment overlapping the
+    # rectangle; if inside is set, only the ones that lie entirely within it.
+    # The result is in the order the outlines were added.
+    def query(self, x0, y0, x1, y1, inside=False):
+        found = set()
+        for by in self._bucket_range(y0, y1):
+            for bx in self._bucket_range(x0, x1):
+                for oid, seg, sb in self.buckets.get((bx, by), ()):
+                    if oid not in found and _overlaps(sb, x0, y0, x1, y1):
+                        found.add(oid)
+        if inside:
+            found = [
+                oid
+                for oid in found
+                if self.boxes[oid][0] >= x0
+                and self.boxes[oid][1] >= y0
+                and self.boxes[oid][2] <= x1
+                and self.boxes[oid][3] <= y1
+            ]
+        return [self.strokes[oid] for oid in sorted(found)]
+
+    # Returns (outline, distance) for the outline closest to the point, or
+    # (None, None) if the index is empty. It searches rings of buckets
+    # outward from the point and stops as soon as no unsearched ring could
+    # hold anything closer than what it has already found.
+    def nearest(self, x, y):
+        if self.extent is None:
+            return None, None
+        cx = int(math.floor(x / self.bucketsize))
+        cy = int(math.floor(y / self.bucketsize))
+        maxr = max(
+            abs(cx - self.extent[0]),
+            abs(cx - self.extent[2]),
+            abs(cy - self.extent[1]),
+            abs(cy - self.extent[3]),
+        )
+        best = None
+        bestd = None
+        for r in range(maxr + 1):
+            if bestd is not None and (r - 1) * self.bucketsize >= bestd:
+                break
+            for bx, by in self._ring(cx, cy, r):
+                for oid, seg, sb in self.buckets.get((bx, by), ()):
+                    d = segment_distance(seg, x, y)
+                    if bestd is None or d < bestd or (d == bestd and oid < best):
+                        best = oid
+                        bestd = d
+        return self.strokes[best], bestd
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield cx, cy
+            return
+        for bx in range(cx - r, cx + r + 1):
+            yield bx, cy - r
+            yield bx, cy + r
+        for by in range(cy - r + 1, cy + r):
+            yield cx - r, by
+            yield cx + r, by
@@ -0,0 +1,219 @@
+# Monte-Carlo statistics for the lattice generator.
+
+# Tuning --n and --nosolo means looking at the distribution of neighborhoods over many boards, and running the
+# pure-Python Board thousands of times is slow. This reimplements the generation rules of Board
+# (generate_lattice, fill_board_randomly, erase_solo_squares and fill_board_iteratively) on NumPy arrays, and
+# runs a whole batch of boards in lockstep: every step makes the same move on every board in the batch, so
+# the per-board cost is a handful of array operations instead of a trip through the Python objects.
+
+# The results follow the same rules, but they use NumPy's random generator, so an individual board won't
+# match the one lattice.py would draw for the same seed; the distributions are what matter here.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# connection bits, in the same order as Grid.directions (N, S, E, W)
+if np is not None:
+    DX = np.array([0, 0, 1, -1])
+    DY = np.array([-1, 1, 0, 0])
+    BITS = np.array([1, 2, 4, 8], dtype=np.uint8)
+    INVERSE_BITS = np.array([2, 1, 8, 4], dtype=np.uint8)
+
+
+class Batch(object):
+    def __init__(self, rng, count, width, height):
+        self.rng = rng
+        self.count = count
+        self.width = width
+        self.height = height
+        self.occupied = np.zeros((count, height, width), dtype=bool)
+        self.connections = np.zeros((count, height, width), dtype=np.uint8)
+        self.num_filled = np.zeros(count, dtype=np.int64)
+        self.probes = np.zeros(count, dtype=np.int64)
+        self.sweeps = np.zeros(count, dtype=np.int64)
+        self.stuck = np.zeros(count, dtype=bool)
+
+    def generate_lattice(self, neighborhoods):
+        # pick distinct seed cells on every board at once
+        area = self.width * self.height
+        order = np.argsort(self.rng.random((self.count, area)), axis=1)
+        seeds = order[:, :neighborhoods]
+        boards = np.repeat(np.arange(self.count), neighborhoods)
+        flat = self.occupied.reshape(self.count, area)
+        flat[boards, seeds.ravel()] = True
+        self.num_filled[:] = neighborhoods
+
+    # For each board in boards, tries to connect the cell at (x, y) to a
+    # randomly-chosen occupied neighbor, like Board.try_connect.
+    # Returns a mask of the boards where it worked.
+    def try_connect(self, boards, x, y):
+        empty = ~self.occupied[boards, y, x]
+        done = np.zeros(len(boards), dtype=bool)
+        order = np.argsort(self.rng.random((len(boards), 4)), axis=1)
+        for trial in range(4):
+            d = order[:, trial]
+            nx = x + DX[d]
+            ny = y + DY[d]
+            inside = (nx >= 0) & (nx < self.width) & (ny >= 0) & (ny < self.height)
+            # out-of-bounds neighbors wrap around here, but inside masks them
+            ok = empty & ~done & inside & self.occupied[boards, ny % self.height, nx % self.width]
+            if not ok.any():
+                continue
+            b = boards[ok]
+            self.occupied[b, y[ok], x[ok]] = True
+            self.connections[b, y[ok], x[ok]] |= BITS[d[ok]]
+            self.connections[b, ny[ok], nx[ok]] |= INVERSE_BITS[d[ok]]
+            self.num_filled[b] += 1
+            done |= ok
+        return done
+
+    def fill_board_randomly(self):
+        area = self.width * self.height
+        failures = np.zeros(self.count, dtype=np.int64)
+        active = np.arange(self.count)
+        while len(active) > 0:
+            x = self.rng.integers(0, self.width, size=len(active))
+            y = self.rng.integers(0, self.height, size=len(active))
+            ok = self.try_connect(active, x, y)
+            self.probes[active] += 1
+            failures[active] = np.where(ok, 0, failures[active] + 1)
+            keep = (self.num_filled[active] / area < 0.9) | (failures[active] < 10)
+            active = active[keep]
+
+    def erase_solo_squares(self):
+        self.occupied &= self.connections != 0
+
+    def fill_board_iteratively(self):
+        active = np.arange(self.count)
+        while len(active) > 0:
+            self.sweeps[active] += 1
+            failed = np.zeros(len(active), dtype=bool)
+            before = self.num_filled[active].copy()
+            for y in range(self.height):
+                for x in range(self.width):
+                    empty = ~self.occupied[active, y, x]
+                    if not empty.any():
+                        continue
+                    boards = active[empty]
+                    xs = np.full(len(boards), x)
+                    ys = np.full(len(boards), y)
+                    ok = self.try_connect(boards, xs, ys)
+                    failed[np.nonzero(empty)[0][~ok]] = True
+            # a sweep that didn't connect anything will never finish (Board
+            # would spin forever here), so give up on those boards
+            stuck = failed & (self.num_filled[active] == before)
+            self.stuck[active[stuck]] = True
+            active = active[failed & ~stuck]
+
+    # Labels each occupied cell with the smallest flat index in its
+    # neighborhood, by hooking the roots of connected cells onto each other
+    # and then pointer-jumping until every cell points at its root; that takes
+    # a logarithmic number of rounds rather than one per cell of the longest
+    # path. Unoccupied cells get -1.
+    def label_neighborhoods(self):
+        flat = self.connections.ravel()
+        cells = np.arange(len(flat), dtype=np.int64)
+        south = cells[(flat & 2) != 0]
+        east = cells[(flat & 4) != 0]
+        u = np.concatenate([south, east])
+        v = np.concatenate([south + self.width, east + 1])
+        labels = cells.copy()
+        while True:
+            lu = labels[u]
+            lv = labels[v]
+            if np.array_equal(lu, lv):
+                break
+            low = np.minimum(lu, lv)
+            np.minimum.at(labels, lu, low)
+            np.minimum.at(labels, lv, low)
+            while True:
+                jumped = labels[labels]
+                if np.array_equal(jumped, labels):
+                    break
+                labels = jumped
+        return np.where(self.occupied.ravel(), labels, -1)
+
+    # returns a dict of per-board arrays, plus the sizes of every neighborhood
+    def results(self):
+        area = self.width * self.height
+        labels = self.label_neighborhoods()
+        labels = labels[labels >= 0]
+        ids, sizes = np.unique(labels, return_counts=True)
+        owner = ids // area
+        counts = np.bincount(owner, minlength=self.count)
+        solo = np.bincount(owner[sizes == 1], minlength=self.count)
+        return dict(
+            neighborhoods=counts,
+            solo=solo,
+            probes=self.probes,
+            sweeps=self.sweeps,
+            stuck=self.stuck,
+            sizes=sizes,
+        )
+
+
+def simulate(width, height, neighborhoods=0, nosolo=False, runs=1000, seed=0, batch=1024):
+    if np is None:
+        raise ImportError("the statistics mode needs numpy")
+    area = width * height
+    if neighborhoods == 0:
+        neighborhoods = int(area / 5)
+    if neighborhoods > area:
+        raise ValueError(f"can't seed {neighborhoods} neighborhoods in {area} cells")
+    rng = np.random.default_rng(seed if seed != 0 else None)
+    parts = []
+    done = 0
+    while done < runs:
+        b = Batch(rng, min(batch, runs - done), width, height)
+        b.generate_lattice(neighborhoods)
+        b.fill_board_randomly()
+        if nosolo:
+            b.erase_solo_squares()
+        b.fill_board_iteratively()
+        parts.append(b.results())
+        done += b.count
+    results = dict()
+    for k in parts[0]:
+        results[k] = np.concatenate([p[k] for p in parts])
+    results["runs"] = runs
+    results["area"] = area
+    return results
+
+
+def _describe(values):
+    if len(values) == 0:
+        return "n/a"
+    p = np.percentile(values, [5, 50, 95])
+    return (
+        f"mean {np.mean(values):.2f} sd {np.std(values):.2f} "
+        f"min {np.min(values)} p5 {p[0]:g} median {p[1]:g} p95 {p[2]:g} max {np.max(values)}"
+    )
+
+
+def print_statistics(results):
+    sizes = results["sizes"]
+    counts = results["neighborhoods"]
+    print(f"{results['runs']} boards of {results['area']} cells")
+    print(f"  neighborhoods per board: {_describe(counts)}")
+    print(f"  neighborhood size:       {_describe(sizes)}")
+    print(
+        f"  solo neighborhoods:      {np.sum(results['solo']) / max(1, np.sum(counts)):.2%} "
+        f"of neighborhoods, {np.sum(sizes == 1) / (results['runs'] * results['area']):.2%} of cells"
+    )
+    print(f"  random probes:           {_describe(results['probes'])}")
+    print(f"  fill sweeps:             {_describe(results['sweeps'])}")
+    if np.any(results["stuck"]):
+        print(f"  stuck boards:            {np.sum(results['stuck'])} (left partly empty)")
+    print("  size histogram:")
+    edges = [1, 2, 3, 4, 5, 9, 17, 33, 65]
+    for i, lo in enumerate(edges):
+        hi = edges[i + 1] if i + 1 < len(edges) else None
+        if hi is None:
+            n = np.sum(sizes >= lo)
+            label = f"{lo}+"
+        else:
+            n = np.sum((sizes >= lo) & (sizes < hi))
+            label = f"{lo}" if hi == lo + 1 else f"{lo}-{hi - 1}"
+        print(f"    {label:>6}: {n / max(1, len(sizes)):7.2%}")
@@ -10,9 +10,51 @@ from string import Template
 import sys
 
 
+# Every coordinate goes through _sc, but they all lie on the lattice (cell multiples of a few shortcut offsets, plus
+# the tweened control points), so there are few distinct values; _sc remembers the strings it has made. The values
+# are already quantized by the lattice, so they're used as keys as they are. The cache is emptied when it reaches
+# SC_CACHE_SIZE entries; the outlines come out roughly row by row, so it refills with the values of the current rows.
+SC_CACHE_SIZE = 1 << 16
+_sc_cache = dict()
+_sc_stats = [0, 0]  # lookups, misses
+_sc_precision = 1
+_sc_format = "{:.1f}".format
+
+
 def _sc(v):
     "converts from mm to pixels as a numeric string"
-    return "{:.1f}".format(v)  # * 96 / 25.4)
+    _sc_stats[0] += 1
+    try:
+        return _sc_cache[v]
+    except KeyError:
+        _sc_stats[1] += 1
+        if len(_sc_cache) >= SC_CACHE_SIZE:
+            _sc_cache.clear()
+        s = _sc_cache[v] = _sc_format(v)  # * 96 / 25.4)
+        return s
+
+
+def set_precision(digits):
+    "sets the number of decimals written for every number"
+    global _sc_precision, _sc_format
+    _sc_precision = digits
+    _sc_format = ("{:.%df}" % digits).format
+    _sc_cache.clear()
+
+
+def get_precision():
+    return _sc_precision
+
+
+def sc_cache_stats():
+    "returns (lookups, misses, entries) for the number formatting cache"
+    return _sc_stats[0], _sc_stats[1], len(_sc_cache)
+
+
+def add_sc_cache_stats(lookups, misses):
+    "adds counts from another process (such as a rendering worker)"
+    _sc_stats[0] += lookups
+    _sc_stats[1] += misses
 
 
 def _col(color):
@@ -22,7 +64,7 @@ def _col(color):
     return color
 
 
-tmpl_svg = Template(
+tmpl_svg_head = Template(
     """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
 <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
 <svg width="${pixel_width}px" height="${pixel_height}px" version="1.1"
@@ -31,11 +73,15 @@ tmpl_svg = Template(
     xml:space="preserve"
     xmlns:serif="http://www.serif.com/"
     style="fill-rule:evenodd;clip-rule:evenodd;stroke-linecap:round;stroke-linejoin:round;stroke-miterlimit:1.5;">
-${contents}
-</svg>
 """
 )
 
+tmpl_svg_tail = """
+</svg>
+"""
+
+tmpl_svg = Template(tmpl_svg_head.template + "${contents}" + tmpl_svg_tail)
+
 tmpl_path = Template(
     """        <path d="${path}" style="fill:${fill_color};stroke:${stroke_color};stroke-width:${stroke_pixels}px;"/>
 """
@@ -119,6 +165,8 @@ class SVGDoc(object):
         self.lineWidth = 0.5  # default is mm so we need to convert
         self.pageSize = [0, 0]
         self.author = ""
+        self.ofh = None
+        self.written = 0  # characters written so far when streaming
 
     def setPageSize(self, pageSize):
         self.pageSize = pageSize
@@ -135,12 +183,28 @@ class SVGDoc(object):
     def setLineWidth(self, lw):
         self.lineWidth = lw
 
+    # After begin(), elements are written to the file as soon as they're drawn
+    # instead of being held until save(), so the page size must be set first.
+    def begin(self):
+        self.ofh = open(self.filename, "w")
+        pgw, pgh = _sc(self.pageSize[0]), _sc(self.pageSize[1])
+        head = tmpl_svg_head.substitute(dict(pixel_width=pgw, pixel_height=pgh))
+        self.ofh.write(head)
+        self.written = len(head)
+
+    def add_element(self, elt):
+        if self.ofh is not None:
+            self.ofh.write(elt)
+            self.written += len(elt)
+        else:
+            self.elements.append(elt)
+
     def drawString(self, x, y, st):
         # String must be free of metacharacters
         self.comments.append((x, y, st))
 
     def draw_rect(self, x, y, w, h):
-        self.elements.append(
+        self.add_element(
             tmpl_rect.substitute(
                 dict(
                     x=_sc(x),
@@ -158,7 +222,7 @@ class SVGDoc(object):
         s = "M{},{}".format(_sc(p[0][0]), _sc(p[0][1]))
         s += "".join(["L{},{}".format(_sc(pt[0]), _sc(pt[1])) for pt in p[1:-1]])
         s += "Z"
-        self.elements.append(
+        self.add_element(
             tmpl_path.substitute(
                 dict(
                     path=s,
@@ -173,7 +237,7 @@ class SVGDoc(object):
     def draw_open_linear_path(self, p):
         s = "M{},{}".format(_sc(p[0][0]), _sc(p[0][1]))
         s += "".join(["L{},{}".format(_sc(pt[0]), _sc(pt[1])) for pt in p[1:]])
-        self.elements.append(
+        self.add_element(
             tmpl_path.substitute(
                 dict(
                     path=s,
@@ -187,7 +251,7 @@ class SVGDoc(object):
         s = "M{},{}".format(_sc(p[0][0]), _sc(p[0][1]))
         s += "".join(["L{},{}".format(_sc(pt[0]), _sc(pt[1])) for pt in p[1:-1]])
         s += "Z"
-        self.elements.append(
+        self.add_element(
             tmpl_path.substitute(
                 dict(
                     path=s,
@@ -198,7 +262,7 @@ class SVGDoc(object):
         )
 
     def draw_element(self, elt):
-        self.elements.append(
+        self.add_element(
             tmpl_path.substitute(
                 dict(
                     path=elt,
@@ -210,6 +274,12 @@ class SVGDoc(object):
         )
 
     def save(self):
+        if self.ofh is not None:
+            self.ofh.write(tmpl_svg_tail)
+            self.written += len(tmpl_svg_tail)
+            self.ofh.close()
+            self.ofh = None
+            return
         s = "".join([e for e in self.elements])
         pgw, pgh = _sc(self.pageSize[0]), _sc(self.pageSize[1])
         svg = tmpl_svg.substitute(dict(pixel_width=pgw, pixel_height=pgh, contents=s))
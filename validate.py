@@ -0,0 +1,197 @@
+# Structural checks for boards and outlines.
+
+# These look for the mistakes that would otherwise only show up as an assert, a missing stroke end, or a bad cut:
+# connections that don't have a matching connection in the neighbor, connections off the edge of the board, cells
+# left empty after the fill, outlines that aren't closed or have gaps, and outlines that share an endpoint. Problems
+# go into a ValidationReport instead of stopping the program.
+
+# Everything is a single pass. The board checks compare whole rows of connection masks with bytes.translate, so they
+# run at C speed; the outline checks look at each segment once, and remember the lattice points they've seen in a
+# bitmap rather than a set, so they stay small on boards of millions of cells.
+
+
+class ValidationReport(object):
+    # only the first few examples of each kind of problem are kept
+    MAX_EXAMPLES = 10
+
+    def __init__(self):
+        self.counts = dict()
+        self.examples = dict()
+        self.cells = 0
+        self.outlines = 0
+
+    def add(self, kind, detail):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < self.MAX_EXAMPLES:
+            examples.append(detail)
+
+    def merge(self, other):
+        self.cells += other.cells
+        self.outlines += other.outlines
+        for kind, n in other.counts.items():
+            self.counts[kind] = self.counts.get(kind, 0) + n
+            examples = self.examples.setdefault(kind, [])
+            room = self.MAX_EXAMPLES - len(examples)
+            examples.extend(other.examples[kind][:room])
+
+    def ok(self):
+        return len(self.counts) == 0
+
+    def __str__(self):
+        lines = [
+            f"validation: {'ok' if self.ok() else 'FAILED'} "
+            f"({self.cells} cells, {self.outlines} outlines)"
+        ]
+        for kind in sorted(self.counts):
+            lines.append(f"  {kind}: {self.counts[kind]}")
+            for detail in self.examples[kind]:
+                lines.append(f"    {detail}")
+        return "\n".join(lines)
+
+
+def _bit_table(bit):
+    "a bytes.translate table that maps each mask to 1 if it has the bit, else 0"
+    return bytes([1 if m & bit else 0 for m in range(256)])
+
+
+# the bits follow the order of Grid.directions: N, S, E, W
+_NORTH = _bit_table(1)
+_SOUTH = _bit_table(2)
+_EAST = _bit_table(4)
+_WEST = _bit_table(8)
+_BAD = bytes([1 if m > 15 else 0 for m in range(256)])
+
+
+def _positions(flags):
+    "returns the indexes of the nonzero bytes"
+    return [i for i, f in enumerate(flags) if f]
+
+
+# Checks that every cell is occupied, and that every connection stays on the
+# board and is matched by the opposite connection in the neighbor.
+def check_board(masks, occupied, width, height, report):
+    report.cells += width * height
+    if occupied.count(0) > 0:
+        for i in _positions(bytes(1 if o == 0 else 0 for o in occupied)):
+            report.add("empty cell", f"({i % width}, {i // width})")
+    prev_south = None
+    for y in range(height):
+        row = bytes(masks[y * width : (y + 1) * width])
+        if row.translate(_BAD).count(1) > 0:
+            for x in _positions(row.translate(_BAD)):
+                report.add("invalid mask", f"({x}, {y}) has mask {row[x]}")
+        north = row.translate(_NORTH)
+        south = row.translate(_SOUTH)
+        east = row.translate(_EAST)
+        west = row.translate(_WEST)
+        # north connections must match the south connections of the row above
+        if prev_south is None:
+            for x in _positions(north):
+                report.add("connection off the board", f"({x}, {y}) north")
+        elif north != prev_south:
+            for x in range(width):
+                if north[x] != prev_south[x]:
+                    report.add(
+                        "one-way connection", f"({x}, {y}) and ({x}, {y - 1})"
+                    )
+        # east connections must match the west connections of the next cell
+        if east[:-1] != west[1:]:
+            for x in range(width - 1):
+                if east[x] != west[x + 1]:
+                    report.add(
+                        "one-way connection", f"({x}, {y}) and ({x + 1}, {y})"
+                    )
+        if west[0]:
+            report.add("connection off the board", f"(0, {y}) west")
+        if east[-1]:
+            report.add("connection off the board", f"({width - 1}, {y}) east")
+        prev_south = south
+    if prev_south is not None:
+        for x in _positions(prev_south):
+            report.add("connection off the board", f"({x}, {height - 1}) south")
+
+
+# Checks outlines as they go by: each must be closed with no gaps, and no two
+# segment ends may land on the same point, in the same outline or another.
+# Points are in lattice units, and must be integers within the rectangle
+# (x0, y0)-(x1, y1). The bitmap of seen points is numbered from row 0 whatever
+# y0 is, and starts on a whole byte, so the bitmaps of checkers that cover
+# different rows of the same board can be merged (see merge).
+class OutlineChecker(object):
+    def __init__(self, report, x0, y0, x1, y1):
+        self.report = report
+        self.x0 = x0
+        self.y0 = y0
+        self.y1 = y1
+        self.pitch = x1 - x0 + 1
+        self.base = y0 * self.pitch >> 3
+        self.seen = bytearray(((y1 + 1) * self.pitch + 7 >> 3) - self.base)
+
+    def check(self, stroke):
+        report = self.report
+        report.outlines += 1
+        segs = stroke.segments
+        if len(segs) == 0:
+            report.add("empty outline", str(stroke))
+            return
+        seen = self.seen
+        x0 = self.x0
+        y0 = self.y0
+        y1 = self.y1
+        pitch = self.pitch
+        skip = self.base << 3
+        last = segs[-1].to
+        lx = last.x
+        ly = last.y
+        if segs[0].fr.x != lx or segs[0].fr.y != ly:
+            report.add("unclosed outline", f"from {segs[0].fr} to {last}")
+        for s in segs:
+            fr = s.fr
+            x = fr.x
+            y = fr.y
+            if x != lx or y != ly:
+                report.add("gap in outline", f"from ({lx}, {ly}) to {fr}")
+            to = s.to
+            lx = to.x
+            ly = to.y
+            x -= x0
+            if type(x) is not int or type(y) is not int:
+                # lattice points are whole numbers, even if they're floats
+                if x != int(x) or y != int(y):
+                    report.add("point off the lattice", str(fr))
+                    continue
+                x = int(x)
+                y = int(y)
+            if x < 0 or x >= pitch or y < y0 or y > y1:
+                report.add("point off the lattice", str(fr))
+                continue
+            i = y * pitch + x - skip
+            bit = 1 << (i & 7)
+            if seen[i >> 3] & bit:
+                report.add("shared endpoint", str(fr))
+            else:
+                seen[i >> 3] |= bit
+
+    # Adds the points seen by another checker over rows of the same board (a
+    # band checked in another process), reporting the ones both have seen.
+    def merge(self, other):
+        lo = other.base - self.base
+        n = len(other.seen)
+        mine = int.from_bytes(self.seen[lo : lo + n], "little")
+        theirs = int.from_bytes(other.seen, "little")
+        both = mine & theirs
+        while both:
+            low = both & -both
+            i = (low.bit_length() - 1) + (other.base << 3)
+            self.report.add(
+                "shared endpoint", f"({i % self.pitch + self.x0}, {i // self.pitch})"
+            )
+            both ^= low
+        self.seen[lo : lo + n] = (mine | theirs).to_bytes(n, "little")
+
+    # passes the outlines through, checking each one
+    def checked(self, strokes):
+        for s in strokes:
+            self.check(s)
+            yield s